@@ -7,9 +7,17 @@ Telegram Media Forwarder Bot
 """
 
 import asyncio
+import base64
+import functools
 import json
 import logging
 import os
+import queue
+import time
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from collections import OrderedDict
+from enum import IntFlag
 from typing import Dict, List, Optional, Set, Tuple, Union, Any
 
 from telethon import TelegramClient, events
@@ -21,7 +29,9 @@ from telethon.tl.types import (
     Message
 )
 
-from aiogram import Bot, Dispatcher, F
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -35,25 +45,93 @@ from aiogram.types import (
     Message as AiogramMessage
 )
 
+# orjson (опционально): C-реализация JSON в разы быстрее стандартной —
+# выгодно и на кодировании исходящих вызовов API, и на разборе getUpdates
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
 # Конфигурация
 BOT_TOKEN = 'ВАШ ТОКЕН'
 API_ID = 'ВАШ API_ID'
 API_HASH = 'ВАШ API_HASH'
 SESSION_NAME = 'media_forwarder'
 DEFAULT_DELAY = 3  # Задержка по умолчанию (в секундах)
+SAVE_DEBOUNCE = 1.0  # Задержка отложенной записи конфигурации (в секундах)
+BLOOM_SIZE_BYTES = 1024  # Размер фильтра Блума для дедупликации групп медиа (в байтах)
+ALBUM_COALESCE_DELAY = 0.5  # Окно накопления сообщений одного альбома (в секундах)
+MIN_ADAPTIVE_DELAY = 0.5  # Нижняя граница адаптивной задержки (в секундах)
+MAX_ADAPTIVE_DELAY = 60  # Верхняя граница адаптивной задержки (в секундах)
+FORWARD_CONCURRENCY = 4  # Сколько запросов пересылки выполняем параллельно
+RESTORE_CONCURRENCY = 5  # Сколько пересылок восстанавливаем параллельно при старте
+FORWARD_CHUNK_SIZE = 25  # Максимум сообщений в одном запросе пересылки
+WORK_QUEUE_SIZE = 500  # Емкость очереди тяжелых задач от обработчиков кнопок
+WORK_WORKERS = 8  # Сколько воркеров разбирают очередь тяжелых задач
+WORK_PACING_DELAY = 0.3  # Пауза воркера между задачами (суммарно < 30 запросов/с)
+ACTIVE_FORWARDS_CACHE_TTL = 2  # Кэш списка активных пересылок (в секундах)
+DENY_QUEUE_SIZE = 1000  # Емкость очереди отложенных ответов об отказе
+DENY_PACING_DELAY = 1 / 25  # Пауза между отказами (заведомо ниже лимита бота)
+ENTITY_CACHE_TTL = 300  # Время жизни кэша сущностей Telegram (в секундах)
+DIALOG_CACHE_TTL = 300  # Время жизни кэша списка диалогов (в секундах)
+DIALOG_PAGE_CACHE_TTL = 30  # Время жизни кэша готовых страниц диалогов (в секундах)
+DIALOG_PAGE_CACHE_SIZE = 32  # Сколько страниц диалогов держим в кэше
 CONFIG_FILE = 'forwarder_config.json'
 SAVED_MESSAGES_KEY = 'saved'  # Сокращенный ключ для callback_data
 
+# Публичный URL вебхука (например 'https://example.com/tg'). Если пусто,
+# бот работает через long polling; вебхук убирает задержку цикла getUpdates
+WEBHOOK_URL = ''
+WEBHOOK_PATH = '/tg'  # Путь, на который Telegram шлет обновления
+WEBHOOK_HOST = '0.0.0.0'  # Интерфейс встроенного aiohttp-сервера
+WEBHOOK_PORT = 8080  # Порт встроенного aiohttp-сервера
+
+# Адрес локального сервера Bot API (например 'http://127.0.0.1:8081'),
+# развернутого рядом с ботом: вызовы API теряют WAN-задержку до Telegram.
+# Пустая строка — обычный облачный api.telegram.org
+LOCAL_API_URL = ''
+
 # ID администратора (только этот пользователь сможет использовать бота)
 ADMIN_USER_ID = ВАШ ADMIN_USER_ID
 
-# Настройка логирования
+# Множество разрешенных ID: проверка членства за O(1) и легко расширяется
+# на нескольких администраторов
+ADMIN_IDS = frozenset((ADMIN_USER_ID,))
+
+# Настройка логирования: горячий путь только кладет записи в очередь,
+# а синхронную запись в stdout выполняет отдельный поток-слушатель
+_log_queue = queue.Queue(-1)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    handlers=[QueueHandler(_log_queue)]
 )
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
 logger = logging.getLogger(__name__)
 
+# Сильные ссылки на фоновые задачи: цикл событий хранит задачи слабо,
+# и задача без внешней ссылки может быть собрана GC до завершения
+_BG: Set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    """Создает фоновую задачу и удерживает ссылку на нее до завершения"""
+    task = asyncio.ensure_future(coro)
+    _BG.add(task)
+    task.add_done_callback(_BG.discard)
+    return task
+
+
 # Состояния для FSM (Finite State Machine)
 class ForwardingStates(StatesGroup):
     waiting_for_source = State()
@@ -64,15 +142,116 @@ class ForwardingStates(StatesGroup):
     waiting_for_limit = State()
 
 
+class MediaTypes(IntFlag):
+    """Битовая маска типов медиаконтента для пересылки
+
+    Проверка типа в горячем пути — одна операция AND над int вместо
+    хеширования строки и поиска в множестве.
+    """
+    NONE = 0
+    PHOTO = 1
+    VIDEO = 2
+    DOCUMENT = 4
+    ALL = PHOTO | VIDEO | DOCUMENT
+
+
+# Соответствие имен типов медиа (callback_data и старый формат конфигурации) битам маски
+MEDIA_TYPE_BITS = {
+    'photo': MediaTypes.PHOTO,
+    'video': MediaTypes.VIDEO,
+    'document': MediaTypes.DOCUMENT,
+}
+
+
+# Человекочитаемые подписи типов медиа (порядок отображения фиксирован)
+_MEDIA_LABELS = (('photo', 'Фото'), ('video', 'Видео'), ('document', 'Документы'))
+
+# Все 21 вариант шкалы прогресса, индекс — percentage // 5
+_BARS = tuple("█" * min(i + 1, 20) + "░" * (20 - min(i + 1, 20)) for i in range(21))
+
+
+def media_mask_from_names(names) -> MediaTypes:
+    """Преобразует имена типов медиа в битовую маску"""
+    mask = MediaTypes.NONE
+    for name in names:
+        mask |= MEDIA_TYPE_BITS.get(name, MediaTypes.NONE)
+    return mask
+
+
+def media_names_from_mask(mask: MediaTypes) -> List[str]:
+    """Преобразует битовую маску в список имен типов медиа"""
+    return [name for name, bit in MEDIA_TYPE_BITS.items() if mask & bit]
+
+
+class BloomFilter:
+    """Компактный фильтр Блума для вопроса "видели ли мы эту группу медиа?"
+
+    Фиксированный размер, O(1) проверка, сериализуется в base64 для
+    хранения в конфигурации — дедупликация переживает перезапуск бота.
+    При заполнении фильтр сбрасывается, чтобы доля ложных срабатываний
+    оставалась ограниченной.
+    """
+
+    # Множители для трех независимых проб (константы расщепления Фибоначчи)
+    _SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9)
+    _MASK64 = 0xFFFFFFFFFFFFFFFF
+
+    def __init__(self, encoded: Optional[str] = None, size_bytes: int = BLOOM_SIZE_BYTES):
+        self.bits = bytearray(size_bytes)
+        self.count = 0
+        if encoded:
+            try:
+                decoded = bytearray(base64.b64decode(encoded))
+                if len(decoded) == size_bytes:
+                    self.bits = decoded
+            except Exception as e:
+                logger.error("Не удалось восстановить фильтр групп: %s", e)
+
+    def _probes(self, value: int):
+        """Выдает позиции битов для значения"""
+        n_bits = len(self.bits) * 8
+        v = value & self._MASK64
+        for seed in self._SEEDS:
+            yield (((v * seed) & self._MASK64) >> 17) % n_bits
+
+    def add(self, value: int) -> bool:
+        """Добавляет значение; возвращает True, если оно уже встречалось"""
+        present = True
+        for bit in self._probes(value):
+            byte_index, bit_mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte_index] & bit_mask:
+                present = False
+                self.bits[byte_index] |= bit_mask
+        if not present:
+            self.count += 1
+            # Периодический сброс переполненного фильтра
+            if self.count * len(self._SEEDS) * 2 > len(self.bits) * 8:
+                self.bits = bytearray(len(self.bits))
+                self.count = 0
+        return present
+
+    def encode(self) -> str:
+        """Сериализует фильтр в base64 для сохранения в конфигурации"""
+        return base64.b64encode(bytes(self.bits)).decode('ascii')
+
+
 class Configuration:
     """Класс для управления настройками бота"""
-    
+
+    # Атрибуты читаются из горячего пути пересылки — __slots__ дает
+    # C-индексацию вместо поиска в __dict__ и экономит память
+    __slots__ = ('filename', 'data', '_dirty', '_save_handle', '_flush_task')
+
     def __init__(self, filename=CONFIG_FILE):
         self.filename = filename
         self.data = {
             'delay': DEFAULT_DELAY,
-            'active_forwards': []
+            'active_forwards': {}
         }
+        # Отложенная запись: флаг изменений и запланированный вызов _flush
+        self._dirty = False
+        self._save_handle = None
+        self._flush_task = None
         self.load()
     
     def load(self):
@@ -81,59 +260,128 @@ class Configuration:
             if os.path.exists(self.filename):
                 with open(self.filename, 'r', encoding='utf-8') as f:
                     self.data = json.load(f)
-                logger.info(f"Конфигурация загружена из {self.filename}")
+                # Миграция старого формата: список пересылок превращаем
+                # в словарь с ключом "источник|цель" для O(1) доступа
+                forwards = self.data.get('active_forwards', {})
+                migrated = isinstance(forwards, list)
+                if migrated:
+                    forwards = {
+                        f"{fwd['source_id']}|{fwd['target_id']}": fwd
+                        for fwd in forwards
+                    }
+                    self.data['active_forwards'] = forwards
+                # Миграция типов медиа: список имен превращаем в битовую маску
+                for fwd in forwards.values():
+                    if isinstance(fwd.get('media_types'), list):
+                        fwd['media_types'] = int(media_mask_from_names(fwd['media_types']))
+                        migrated = True
+                if migrated:
+                    self.save()
+                logger.info("Конфигурация загружена из %s", self.filename)
         except Exception as e:
-            logger.error(f"Ошибка загрузки конфигурации: {e}")
+            logger.error("Ошибка загрузки конфигурации: %s", e)
     
     def save(self):
-        """Сохранение конфигурации в файл"""
+        """Планирует отложенное сохранение конфигурации (дебаунс)
+
+        Несколько подряд идущих изменений объединяются в одну запись на диск,
+        чтобы не блокировать цикл событий на каждой мутации.
+        """
+        self._dirty = True
+        if self._save_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Цикл событий еще не запущен — сохраняем сразу
+                self.save_now()
+                return
+            self._save_handle = loop.call_later(SAVE_DEBOUNCE, self._flush)
+
+    def _flush(self):
+        """Запускает отложенную запись конфигурации в пуле потоков
+
+        Дисковое IO уходит в поток-исполнитель, чтобы цикл событий
+        (в том числе чтение обновлений Telethon) не простаивал на записи.
+        """
+        self._save_handle = None
+        if self._dirty:
+            self._flush_task = _spawn(asyncio.to_thread(self.save_now))
+
+    def save_now(self):
+        """Немедленное сохранение конфигурации в файл (атомарная запись)"""
         try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
+            tmp_filename = self.filename + '.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
                 json.dump(self.data, f, ensure_ascii=False, indent=2)
-            logger.info(f"Конфигурация сохранена в {self.filename}")
+            # Атомарная замена, чтобы не получить поврежденный файл при сбое
+            os.replace(tmp_filename, self.filename)
+            self._dirty = False
+            logger.info("Конфигурация сохранена в %s", self.filename)
         except Exception as e:
-            logger.error(f"Ошибка сохранения конфигурации: {e}")
+            logger.error("Ошибка сохранения конфигурации: %s", e)
     
     def set_delay(self, delay: int):
         """Установка задержки между пересылками"""
         self.data['delay'] = delay
         self.save()
     
-    def add_active_forward(self, source_id: Union[int, str], target_id: Union[int, str], media_types: List[str]):
+    @staticmethod
+    def _forward_key(source_id: Union[int, str], target_id: Union[int, str]) -> str:
+        """Строит ключ пересылки вида "источник|цель" """
+        return f"{source_id}|{target_id}"
+
+    def add_active_forward(self, source_id: Union[int, str], target_id: Union[int, str], media_mask: int):
         """Добавление новой активной пересылки"""
-        # Удаляем дубликаты, если есть
-        self.data['active_forwards'] = [
-            fwd for fwd in self.data['active_forwards'] 
-            if not(str(fwd['source_id']) == str(source_id) and str(fwd['target_id']) == str(target_id))
-        ]
-        
-        self.data['active_forwards'].append({
+        key = self._forward_key(source_id, target_id)
+        entry = {
             'source_id': str(source_id),
             'target_id': str(target_id),
-            'media_types': list(media_types)
-        })
+            'media_types': int(media_mask)
+        }
+        # Сохраняем накопленный фильтр групп при перезаписи пересылки
+        old_entry = self.data['active_forwards'].get(key)
+        if old_entry and 'seen_groups' in old_entry:
+            entry['seen_groups'] = old_entry['seen_groups']
+        self.data['active_forwards'][key] = entry
         self.save()
-    
+
+    def get_active_forward(self, source_id: Union[int, str], target_id: Union[int, str]) -> Optional[Dict]:
+        """Получение записи активной пересылки, если она есть"""
+        return self.data['active_forwards'].get(self._forward_key(source_id, target_id))
+
+    def update_forward_filter(self, source_id: Union[int, str], target_id: Union[int, str], encoded: str):
+        """Сохраняет сериализованный фильтр групп медиа для пересылки"""
+        entry = self.get_active_forward(source_id, target_id)
+        if entry is not None:
+            entry['seen_groups'] = encoded
+            self.save()
+
     def remove_active_forward(self, source_id: Union[int, str], target_id: Union[int, str]) -> bool:
         """Удаление активной пересылки"""
-        initial_length = len(self.data['active_forwards'])
-        self.data['active_forwards'] = [
-            fwd for fwd in self.data['active_forwards'] 
-            if not(str(fwd['source_id']) == str(source_id) and str(fwd['target_id']) == str(target_id))
-        ]
-        if len(self.data['active_forwards']) < initial_length:
+        removed = self.data['active_forwards'].pop(self._forward_key(source_id, target_id), None)
+        if removed is not None:
             self.save()
             return True
         return False
-    
+
     def get_active_forwards(self) -> List[Dict]:
         """Получение списка активных пересылок"""
-        return self.data['active_forwards']
+        return list(self.data['active_forwards'].values())
 
 
 class MediaForwarder:
     """Основной класс для пересылки медиафайлов"""
-    
+
+    __slots__ = (
+        'api_id', 'api_hash', 'session_name', 'config', 'client',
+        'source_chat', 'target_chat', 'source_name', 'target_name',
+        'media_mask', 'active_forwards',
+        'message_count', 'handlers', 'saved_messages', 'group_filters',
+        '_album_buffers', '_album_timers', '_media_checkers',
+        '_current_delay', '_forward_sem', '_entity_cache', '_dialog_cache',
+        '_dialog_page_cache', '_input_targets', '_version',
+    )
+
     def __init__(self, api_id: str, api_hash: str, session_name: str, config: Configuration):
         self.api_id = api_id
         self.api_hash = api_hash
@@ -142,17 +390,45 @@ class MediaForwarder:
         self.client = None
         self.source_chat = None
         self.target_chat = None
-        self.media_types: Set[str] = set()
-        # Словарь активных пересылок {(source_id, target_id): {media_types, is_running}}
+        # Отображаемые имена выбранных чатов: вычисляются один раз при выборе
+        self.source_name = None
+        self.target_name = None
+        self.media_mask: MediaTypes = MediaTypes.NONE
+        # Словарь активных пересылок {(source_id, target_id): {media_mask, is_running}}
         self.active_forwards: Dict[Tuple[str, str], Dict] = {}
+        # Версия списка пересылок: растет при каждом изменении, внешние
+        # кэши сбрасываются по ней сразу, а не по истечении TTL
+        self._version = 0
         # Счетчик пересланных сообщений
         self.message_count = 0
+        # Адаптивная задержка между пересылками (по образцу TCP congestion control):
+        # уменьшается на успехах, удваивается при FloodWait
+        self._current_delay = float(config.data.get('delay', DEFAULT_DELAY))
+        # Ограничитель параллельных запросов пересылки
+        self._forward_sem = asyncio.Semaphore(FORWARD_CONCURRENCY)
+        # Кэш сущностей Telegram {id: (момент получения, сущность)}
+        self._entity_cache: Dict[str, Tuple[float, Any]] = {}
+        # Кэш списка диалогов: (момент получения, список словарей)
+        self._dialog_cache: Optional[Tuple[float, List[Dict]]] = None
+        # Кэш готовых страниц {(query, offset, limit): (момент, страница, всего)}
+        self._dialog_page_cache: OrderedDict = OrderedDict()
+        # Заранее разрешенные InputPeer целей {(source_id, target_id): InputPeer}
+        self._input_targets: Dict[Tuple[str, str], Any] = {}
         # Словарь обработчиков событий {(source_id, target_id): handler}
         self.handlers: Dict[Tuple[str, str], Any] = {}
         # Чат с "Избранным" (Saved Messages)
         self.saved_messages = None
-        # Словарь для отслеживания уже пересланных групп медиа
-        self.forwarded_groups: Dict[Tuple[str, str], Set[int]] = {}
+        # Фильтры уже пересланных групп медиа по ключу пересылки
+        self.group_filters: Dict[Tuple[str, str], BloomFilter] = {}
+        # Буферы альбомов: сообщения группы накапливаются и пересылаются одним вызовом
+        self._album_buffers: Dict[Tuple[Tuple[str, str], int], List[Message]] = {}
+        self._album_timers: Dict[Tuple[Tuple[str, str], int], Any] = {}
+        # Таблица проверок по типу message.media: горячий путь — один поиск в словаре
+        # вместо цепочки getattr/hasattr/isinstance на каждое сообщение
+        self._media_checkers = {
+            MessageMediaPhoto: self._check_photo,
+            MessageMediaDocument: self._check_document,
+        }
         
     async def connect(self):
         """Подключение к Telegram API"""
@@ -167,123 +443,193 @@ class MediaForwarder:
         await self.restore_active_forwards()
         
     async def restore_active_forwards(self):
-        """Восстанавливает активные пересылки из сохраненной конфигурации"""
-        for forward in self.config.get_active_forwards():
+        """Восстанавливает активные пересылки из сохраненной конфигурации
+
+        Сущности разрешаются параллельно (под семафором, чтобы не словить
+        FloodWait), поэтому старт с N пересылками не стоит N
+        последовательных обращений к Telegram.
+        """
+        semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+        async def restore_one(forward):
             source_id = forward['source_id']
-            target_id = forward['target_id']
-            media_types = set(forward['media_types'])
-            
-            try:
-                source_entity = await self.client.get_entity(int(source_id))
-                
-                # Проверяем, не является ли целью "Избранное"
-                if str(target_id) == "saved_messages" or str(target_id) == SAVED_MESSAGES_KEY:
-                    target_entity = self.saved_messages
-                    target_id = "saved_messages"  # Стандартизируем ID
-                else:
-                    target_entity = await self.client.get_entity(int(target_id))
-                
-                # Запускаем отслеживание новых сообщений
-                await self.start_forward_monitoring(source_entity, target_entity, media_types)
-                logger.info(f"Восстановлена активная пересылка: {source_id} -> {target_id}")
-            except Exception as e:
-                logger.error(f"Не удалось восстановить пересылку {source_id} -> {target_id}: {e}")
+            target_id = self._norm_target(forward['target_id'])
+            media_mask = MediaTypes(forward.get('media_types', 0))
+
+            async with semaphore:
+                try:
+                    source_entity = await self.get_entity_cached(source_id)
+
+                    # Проверяем, не является ли целью "Избранное"
+                    if target_id == "saved_messages":
+                        target_entity = self.saved_messages
+                    else:
+                        target_entity = await self.get_entity_cached(target_id)
+
+                    # Запускаем отслеживание новых сообщений
+                    await self.start_forward_monitoring(source_entity, target_entity, media_mask)
+                    logger.info("Восстановлена активная пересылка: %s -> %s", source_id, target_id)
+                except Exception as e:
+                    logger.error("Не удалось восстановить пересылку %s -> %s: %s", source_id, target_id, e)
+
+        await asyncio.gather(*[restore_one(f) for f in self.config.get_active_forwards()])
     
-    async def get_dialogs(self, offset=0, limit=10, query=None):
-        """Получение списка диалогов с возможностью поиска и пагинации"""
+    async def _get_dialog_cache(self) -> List[Dict]:
+        """Возвращает кэшированный список диалогов, обновляя его по TTL"""
+        if self._dialog_cache and time.monotonic() - self._dialog_cache[0] < DIALOG_CACHE_TTL:
+            return self._dialog_cache[1]
+
         dialogs = []
         counter = 0
-        
-        # Используем запрос для фильтрации, если он указан
         async for dialog in self.client.iter_dialogs():
-            if query and query.lower() not in dialog.name.lower():
-                continue
-                
-            if counter >= offset:
-                dialogs.append({
-                    'id': dialog.id,
-                    'name': dialog.name,
-                    'type': 'channel' if dialog.is_channel else 
-                           'group' if dialog.is_group else 'user'
-                })
-                
+            # Периодически уступаем цикл событий: Telethon может отдавать
+            # уже буферизованные диалоги без await, и обработчик новых
+            # сообщений иначе будет простаивать до конца перебора
             counter += 1
-            
-            if len(dialogs) >= limit:
-                break
-                
-        return dialogs, counter  # Возвращаем диалоги и общее количество
+            if counter % 50 == 0:
+                await asyncio.sleep(0)
+
+            dialogs.append({
+                'id': dialog.id,
+                'name': dialog.name,
+                # Имя в нижнем регистре считаем один раз для быстрого поиска
+                'name_lower': dialog.name.lower(),
+                'type': 'channel' if dialog.is_channel else
+                       'group' if dialog.is_group else 'user'
+            })
+
+        self._dialog_cache = (time.monotonic(), dialogs)
+        return dialogs
+
+    async def get_dialogs(self, offset=0, limit=10, query=None):
+        """Получение списка диалогов с возможностью поиска и пагинации
+
+        Список диалогов вытягивается из Telegram один раз и кэшируется;
+        пагинация и поиск выполняются локально, поэтому листание страниц
+        не стоит O(offset) повторного перебора. Готовые страницы дополнительно
+        кэшируются на короткий срок — листание вперед-назад по одному и тому же
+        поисковому запросу не фильтрует список заново.
+        """
+        page_key = (query, offset, limit)
+        cached = self._dialog_page_cache.get(page_key)
+        if cached and time.monotonic() - cached[0] < DIALOG_PAGE_CACHE_TTL:
+            self._dialog_page_cache.move_to_end(page_key)
+            return cached[1], cached[2]
+
+        dialogs = await self._get_dialog_cache()
+
+        if query:
+            query_lower = query.lower()
+            dialogs = [d for d in dialogs if query_lower in d['name_lower']]
+
+        page, total = dialogs[offset:offset + limit], len(dialogs)
+        self._dialog_page_cache[page_key] = (time.monotonic(), page, total)
+        if len(self._dialog_page_cache) > DIALOG_PAGE_CACHE_SIZE:
+            self._dialog_page_cache.popitem(last=False)
+        return page, total  # Страница и общее количество
     
+    @staticmethod
+    def _display_name(entity):
+        """Отображаемое имя чата: title для каналов и групп, имя для людей"""
+        return entity.title if hasattr(entity, 'title') else entity.first_name
+
     async def set_source(self, chat_id):
         """Установка источника для пересылки"""
         try:
-            self.source_chat = await self.client.get_entity(int(chat_id))
-            return True, self.source_chat.title if hasattr(self.source_chat, 'title') else self.source_chat.first_name
+            self.source_chat = await self.get_entity_cached(chat_id)
+            self.source_name = self._display_name(self.source_chat)
+            return True, self.source_name
         except Exception as e:
-            logger.error(f"Ошибка при установке источника: {e}")
+            logger.error("Ошибка при установке источника: %s", e)
             return False, None
-            
+
     async def set_target(self, chat_id):
         """Установка цели для пересылки"""
         try:
-            if chat_id == "saved_messages" or chat_id == SAVED_MESSAGES_KEY:
+            if self._norm_target(chat_id) == "saved_messages":
                 self.target_chat = self.saved_messages
-                return True, "Избранное"
+                self.target_name = "Избранное"
             else:
-                self.target_chat = await self.client.get_entity(int(chat_id))
-                return True, self.target_chat.title if hasattr(self.target_chat, 'title') else self.target_chat.first_name
+                self.target_chat = await self.get_entity_cached(chat_id)
+                self.target_name = self._display_name(self.target_chat)
+            return True, self.target_name
         except Exception as e:
-            logger.error(f"Ошибка при установке цели: {e}")
+            logger.error("Ошибка при установке цели: %s", e)
             return False, None
 
-    def should_forward_message(self, message: Message) -> bool:
+    def should_forward_message(self, message: Message, media_mask: Optional[MediaTypes] = None) -> bool:
         """
         Проверяет, нужно ли пересылать сообщение в соответствии с заданными типами медиа
+
+        Маска передается явно: каждый мониторинг работает со своей маской,
+        а не с общим (и потому перезаписываемым) состоянием форвардера.
         """
-        # Если список типов медиа пуст, пересылаем все сообщения с медиа
-        if not self.media_types:
-            return self.has_any_media(message)
-        
-        # Проверяем соответствие заданным типам медиа
-        return self.check_media_type(message)
-    
-    def has_any_media(self, message: Message) -> bool:
-        """Проверяет, содержит ли сообщение какой-либо медиафайл"""
-        return bool(message.media) or bool(getattr(message, 'photo', None)) or bool(getattr(message, 'document', None)) or bool(getattr(message, 'video', None))
-    
-    def check_media_type(self, message: Message) -> bool:
-        """Проверяет, соответствует ли тип медиа заданным критериям"""
-        if not message.media and not getattr(message, 'photo', None) and not getattr(message, 'document', None) and not getattr(message, 'video', None):
+        if media_mask is None:
+            media_mask = self.media_mask
+
+        media = message.media
+        if media is None:
             return False
-            
-        # Проверка на наличие фото
-        if 'photo' in self.media_types:
-            if getattr(message, 'photo', None):
-                return True
-            if hasattr(message, 'media') and isinstance(message.media, MessageMediaPhoto):
-                return True
-                
-        # Проверка на наличие видео
-        if 'video' in self.media_types:
-            if getattr(message, 'video', None):
-                return True
-            if hasattr(message, 'media') and isinstance(message.media, MessageMediaDocument):
-                if hasattr(message.media.document, 'mime_type') and message.media.document.mime_type:
-                    if message.media.document.mime_type.startswith('video/'):
-                        return True
-                
-        # Проверка на наличие документов
-        if 'document' in self.media_types:
-            if getattr(message, 'document', None):
-                return True
-            if hasattr(message, 'media') and isinstance(message.media, MessageMediaDocument):
-                if hasattr(message.media.document, 'mime_type') and message.media.document.mime_type:
-                    if not message.media.document.mime_type.startswith('video/'):
-                        return True
-        
-        return False
+
+        checker = self._media_checkers.get(type(media))
+        if checker is None:
+            # Незнакомый тип медиа: пересылаем, только если фильтр не задан
+            return not media_mask
+        return checker(media, media_mask)
+
+    @staticmethod
+    def _check_photo(media: MessageMediaPhoto, media_mask: MediaTypes) -> bool:
+        """Проверка медиа с фотографией"""
+        return not media_mask or bool(media_mask & MediaTypes.PHOTO)
+
+    @staticmethod
+    def _check_document(media: MessageMediaDocument, media_mask: MediaTypes) -> bool:
+        """Проверка медиа с документом (видео — это документ с mime video/*)"""
+        if not media_mask:
+            return True
+        # Читаем mime_type один раз и различаем видео/документ одной веткой
+        mime_type = media.document.mime_type or ''
+        if mime_type.startswith('video/'):
+            return bool(media_mask & MediaTypes.VIDEO)
+        return bool(media_mask & MediaTypes.DOCUMENT)
     
-    async def start_forward_monitoring(self, source_entity, target_entity, media_types):
+    @staticmethod
+    def _norm_target(target_id) -> str:
+        """Приводит идентификатор цели к каноническому виду
+
+        "Избранное" встречается в двух написаниях (полном и сокращенном для
+        callback_data); нормализуем один раз на границе API, чтобы ключи
+        пересылок всегда совпадали без дополнительных проверок.
+        """
+        target_id = str(target_id)
+        if target_id in ("saved_messages", SAVED_MESSAGES_KEY):
+            return "saved_messages"
+        return target_id
+
+    async def get_entity_cached(self, entity_id):
+        """Возвращает сущность Telegram, кэшируя результат на ENTITY_CACHE_TTL секунд
+
+        Избавляет частые операции (например, вывод списка активных пересылок)
+        от повторных сетевых запросов get_entity.
+        """
+        cache_key = str(entity_id)
+        cached = self._entity_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < ENTITY_CACHE_TTL:
+            return cached[1]
+
+        entity = await self.client.get_entity(int(entity_id))
+        self._entity_cache[cache_key] = (time.monotonic(), entity)
+        return entity
+
+    def _on_forward_success(self):
+        """Плавно уменьшает задержку после успешной пересылки"""
+        self._current_delay = max(MIN_ADAPTIVE_DELAY, self._current_delay * 0.95)
+
+    def _on_flood_wait(self):
+        """Удваивает задержку после FloodWait — сигнал "снизить темп" от Telegram"""
+        self._current_delay = min(MAX_ADAPTIVE_DELAY, self._current_delay * 2)
+
+    async def start_forward_monitoring(self, source_entity, target_entity, media_mask):
         """Запускает отслеживание новых сообщений и их пересылку"""
         source_id = str(source_entity.id)
         target_id = "saved_messages" if target_entity.id == self.saved_messages.id else str(target_entity.id)
@@ -293,191 +639,184 @@ class MediaForwarder:
         if key in self.active_forwards and self.active_forwards[key]['is_running']:
             return False
         
-        # Инициализируем словарь для отслеживания уже пересланных групп медиа
-        self.forwarded_groups[key] = set()
-        self.media_types = media_types
-        
-        # Создаем обработчик для новых сообщений
+        # Восстанавливаем сохраненный фильтр групп медиа (или создаем пустой)
+        saved_entry = self.config.get_active_forward(source_id, target_id)
+        encoded_filter = saved_entry.get('seen_groups') if saved_entry else None
+        self.group_filters[key] = BloomFilter(encoded=encoded_filter)
+
+        # Разрешаем InputPeer цели один раз, чтобы Telethon не делал этого
+        # заново на каждом пересылаемом сообщении
+        input_target = await self.client.get_input_entity(target_entity)
+        self._input_targets[key] = input_target
+
+        # Создаем обработчик для новых сообщений; маска типов медиа
+        # захватывается замыканием и принадлежит только этой пересылке
         async def handler(event):
             key_check = (source_id, target_id)
             if not self.active_forwards.get(key_check, {}).get('is_running', False):
-                logger.info(f"Пересылка остановлена или не существует: {source_id} -> {target_id}")
+                logger.info("Пересылка остановлена или не существует: %s -> %s", source_id, target_id)
                 return
-                
+
             message = event.message
-            
+
             # Если это группа медиа, обрабатываем специальным образом
             if message.grouped_id:
-                await self.process_media_group(message, target_entity, key_check)
+                await self.process_media_group(message, input_target, key_check, media_mask)
             else:
                 # Для одиночных сообщений проверяем тип медиа
-                await self.process_single_message(message, target_entity, key_check)
+                await self.process_single_message(message, input_target, key_check, media_mask)
         
         # Регистрируем обработчик
         event_handler = self.client.add_event_handler(handler, events.NewMessage(chats=source_entity))
         
         # Обновляем состояние
         self.active_forwards[key] = {
-            'media_types': media_types,
+            'media_mask': media_mask,
             'is_running': True
         }
+        self._version += 1
         
         # Сохраняем обработчик
         self.handlers[key] = event_handler
         
         # Сохраняем в конфигурацию
-        self.config.add_active_forward(source_id, target_id, list(media_types))
+        self.config.add_active_forward(source_id, target_id, int(media_mask))
         
-        logger.info(f"Запущена пересылка: {source_id} -> {target_id}")
+        logger.info("Запущена пересылка: %s -> %s", source_id, target_id)
         return True
     
-    async def process_media_group(self, message, target_entity, key):
+    async def process_media_group(self, message, target_entity, key, media_mask=None):
         """
         Обрабатывает группу медиа (альбом)
-        Исправлена версия: не использует параметр grouped_id в get_messages
+
+        Сообщения альбома приходят по одному; вместо дозапроса истории
+        через get_messages накапливаем их в буфере и пересылаем одним
+        вызовом, когда альбом "затихает" на ALBUM_COALESCE_DELAY секунд.
         """
-        # Если это группа медиа, проверяем, не пересылали ли мы уже эту группу
-        if message.grouped_id in self.forwarded_groups[key]:
-            # Эта группа уже была переслана или в процессе пересылки, пропускаем
+        buffer_key = (key, message.grouped_id)
+
+        buffer = self._album_buffers.get(buffer_key)
+        if buffer is None:
+            # Новая группа: проверяем, не пересылали ли мы ее уже
+            # (add возвращает True, если группа встречалась, в т.ч. до рестарта)
+            if self.group_filters[key].add(message.grouped_id):
+                return
+            # Сохраняем фильтр, чтобы дедупликация пережила перезапуск бота
+            self.config.update_forward_filter(key[0], key[1], self.group_filters[key].encode())
+            buffer = self._album_buffers[buffer_key] = []
+
+        buffer.append(message)
+
+        # Перезапускаем окно накопления при каждом новом сообщении альбома
+        timer = self._album_timers.pop(buffer_key, None)
+        if timer is not None:
+            timer.cancel()
+        self._album_timers[buffer_key] = asyncio.get_running_loop().call_later(
+            ALBUM_COALESCE_DELAY,
+            lambda: _spawn(self._flush_album(buffer_key, target_entity, media_mask))
+        )
+
+    async def _flush_album(self, buffer_key, target_entity, media_mask=None):
+        """Пересылает накопленный альбом одним вызовом forward_messages"""
+        self._album_timers.pop(buffer_key, None)
+        group_messages = self._album_buffers.pop(buffer_key, None)
+        if not group_messages:
             return
-        
-        # Отмечаем группу как обрабатываемую
-        self.forwarded_groups[key].add(message.grouped_id)
-        
+
+        key = buffer_key[0]
+        if not self.active_forwards.get(key, {}).get('is_running', False):
+            return
+
         try:
-            # Получаем последние сообщения и фильтруем по grouped_id
-            # Важно: не используем параметр grouped_id в get_messages, так как он не поддерживается
-            all_recent_messages = await self.client.get_messages(
-                message.chat_id,
-                limit=50  # Достаточно для альбома
-            )
-            
-            # Фильтруем сообщения, чтобы получить только те, что входят в ту же группу
-            group_messages = [
-                msg for msg in all_recent_messages 
-                if getattr(msg, 'grouped_id', None) == message.grouped_id
-            ]
-            
             # Если есть хотя бы одно сообщение с подходящим медиа, пересылаем всю группу
-            has_matching_media = any(self.should_forward_message(msg) for msg in group_messages)
-            
-            if has_matching_media and group_messages:
-                # Пересылаем группу сообщений
+            if any(self.should_forward_message(msg, media_mask) for msg in group_messages):
                 await self.client.forward_messages(target_entity, group_messages)
                 self.message_count += len(group_messages)
-                
-                delay = self.config.data['delay']
-                logger.info(f"Переслана группа медиа ({len(group_messages)} элементов). Всего: {self.message_count}")
-                await asyncio.sleep(delay)
-        
+
+                self._on_forward_success()
+                logger.debug("Переслана группа медиа (%s элементов). Всего: %s", len(group_messages), self.message_count)
+                # INFO — только при пересечении очередной сотни сообщений
+                if self.message_count % 100 < len(group_messages):
+                    logger.info("Переслано сообщений: %s", self.message_count)
+                await asyncio.sleep(self._current_delay)
         except FloodWaitError as e:
-            logger.warning(f"Слишком много запросов, ждем {e.seconds} секунд")
+            self._on_flood_wait()
+            logger.warning("Слишком много запросов, ждем %s секунд", e.seconds)
             await asyncio.sleep(e.seconds)
         except Exception as e:
-            logger.error(f"Ошибка при обработке группы медиа: {e}")
-        finally:
-            # Ограничиваем размер списка пересланных групп
-            if len(self.forwarded_groups[key]) > 100:
-                # Удаляем самые старые записи, оставляя последние 50
-                self.forwarded_groups[key] = set(list(self.forwarded_groups[key])[-50:])
+            logger.error("Ошибка при обработке группы медиа: %s", e)
     
-    async def process_single_message(self, message, target_entity, key):
+    async def process_single_message(self, message, target_entity, key, media_mask=None):
         """Обрабатывает одиночное сообщение"""
         # Проверяем, соответствует ли сообщение критериям
-        should_forward = self.should_forward_message(message)
+        should_forward = self.should_forward_message(message, media_mask)
         
         if should_forward:
             try:
                 # Пересылаем сообщение
                 await self.client.forward_messages(target_entity, message)
                 self.message_count += 1
-                
-                delay = self.config.data['delay']
-                logger.info(f"Переслано сообщение #{self.message_count}. ID: {message.id}. Дата: {message.date}")
-                await asyncio.sleep(delay)
+
+                self._on_forward_success()
+                logger.debug("Переслано сообщение #%s. ID: %s. Дата: %s", self.message_count, message.id, message.date)
+                # INFO — только раз в сотню сообщений, чтобы не душить обработчик выводом
+                if self.message_count % 100 == 0:
+                    logger.info("Переслано сообщений: %s", self.message_count)
+                await asyncio.sleep(self._current_delay)
             except FloodWaitError as e:
-                logger.warning(f"Слишком много запросов, ждем {e.seconds} секунд")
+                self._on_flood_wait()
+                logger.warning("Слишком много запросов, ждем %s секунд", e.seconds)
                 await asyncio.sleep(e.seconds)
             except Exception as e:
-                logger.error(f"Ошибка при пересылке сообщения {message.id}: {e}")
+                logger.error("Ошибка при пересылке сообщения %s: %s", message.id, e)
     
     async def stop_forward_monitoring(self, source_id, target_id):
         """Останавливает отслеживание новых сообщений"""
         source_id = str(source_id)
-        # Проверяем, не является ли target_id сокращённой версией saved_messages
-        if target_id == SAVED_MESSAGES_KEY:
-            target_id = "saved_messages"
-        else:
-            target_id = str(target_id)
-            
-        logger.info(f"Попытка остановки пересылки: {source_id} -> {target_id}")
+        target_id = self._norm_target(target_id)
+
+
+        logger.info("Попытка остановки пересылки: %s -> %s", source_id, target_id)
         
         # Проверяем наличие пересылки в словаре
         key = (source_id, target_id)
         
         if key in self.active_forwards:
-            logger.info(f"Пересылка найдена в активных: {source_id} -> {target_id}")
+            logger.info("Пересылка найдена в активных: %s -> %s", source_id, target_id)
             # Отмечаем, что пересылка остановлена
             self.active_forwards[key]['is_running'] = False
             
             # Удаляем обработчик события
             if key in self.handlers:
                 try:
-                    logger.info(f"Удаляем обработчик события для: {source_id} -> {target_id}")
+                    logger.info("Удаляем обработчик события для: %s -> %s", source_id, target_id)
                     self.client.remove_event_handler(self.handlers[key])
                     del self.handlers[key]
-                    logger.info(f"Обработчик успешно удален для: {source_id} -> {target_id}")
+                    logger.info("Обработчик успешно удален для: %s -> %s", source_id, target_id)
                 except Exception as e:
-                    logger.error(f"Ошибка при удалении обработчика: {e}")
+                    logger.error("Ошибка при удалении обработчика: %s", e)
             
             # Удаляем из словаря активных пересылок
             del self.active_forwards[key]
+            self._version += 1
             
-            # Удаляем из списка пересланных групп, если есть
-            if key in self.forwarded_groups:
-                del self.forwarded_groups[key]
+            # Удаляем фильтр пересланных групп, если есть
+            if key in self.group_filters:
+                del self.group_filters[key]
+
+            # Удаляем заранее разрешенный InputPeer цели
+            self._input_targets.pop(key, None)
             
             # Удаляем из конфигурации
             self.config.remove_active_forward(source_id, target_id)
-            logger.info(f"Пересылка успешно остановлена: {source_id} -> {target_id}")
+            logger.info("Пересылка успешно остановлена: %s -> %s", source_id, target_id)
             return True
         
-        # Дополнительная проверка для saved_messages с другими вариантами записи
-        if target_id == "saved_messages":
-            # Попробуем поискать с альтернативным ключом
-            alt_key = (source_id, SAVED_MESSAGES_KEY)
-            if alt_key in self.active_forwards:
-                logger.info(f"Пересылка найдена с альтернативным ключом: {source_id} -> {SAVED_MESSAGES_KEY}")
-                # Отмечаем, что пересылка остановлена
-                self.active_forwards[alt_key]['is_running'] = False
-                
-                # Удаляем обработчик события
-                if alt_key in self.handlers:
-                    try:
-                        logger.info(f"Удаляем обработчик события для: {source_id} -> {SAVED_MESSAGES_KEY}")
-                        self.client.remove_event_handler(self.handlers[alt_key])
-                        del self.handlers[alt_key]
-                        logger.info(f"Обработчик успешно удален для: {source_id} -> {SAVED_MESSAGES_KEY}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при удалении обработчика: {e}")
-                
-                # Удаляем из словаря активных пересылок
-                del self.active_forwards[alt_key]
-                
-                # Удаляем из списка пересланных групп, если есть
-                if alt_key in self.forwarded_groups:
-                    del self.forwarded_groups[alt_key]
-                
-                # Удаляем из конфигурации
-                self.config.remove_active_forward(source_id, SAVED_MESSAGES_KEY)
-                logger.info(f"Пересылка успешно остановлена с альтернативным ключом: {source_id} -> {SAVED_MESSAGES_KEY}")
-                return True
-        
         # Проверяем все активные пересылки для отладки
         for k in self.active_forwards.keys():
-            logger.info(f"Активная пересылка: {k[0]} -> {k[1]}")
+            logger.info("Активная пересылка: %s -> %s", k[0], k[1])
         
-        logger.warning(f"Пересылка не найдена: {source_id} -> {target_id}")
+        logger.warning("Пересылка не найдена: %s -> %s", source_id, target_id)
         return False
     
     async def forward_all_media(self, progress_callback=None, limit=None):
@@ -493,15 +832,13 @@ class MediaForwarder:
             # Определяем общее количество сообщений (для прогресса)
             total_messages = 0
             if progress_callback:
-                logger.info("Начинаем подсчет сообщений...")
-                messages_count_iter = self.client.iter_messages(self.source_chat)
-                async for _ in messages_count_iter:
-                    total_messages += 1
-                    # Ограничиваем количество сообщений для подсчета
-                    if total_messages >= 1000:
-                        break
-                
-                logger.info(f"Найдено сообщений: {total_messages}")
+                # Запрос с limit=0 возвращает серверный счетчик сообщений
+                # одним обращением вместо перебора всей истории
+                total_messages = (await self.client.get_messages(self.source_chat, limit=0)).total
+                if limit:
+                    total_messages = min(total_messages, limit)
+
+                logger.info("Найдено сообщений: %s", total_messages)
                 await progress_callback(0, total_messages, "Подсчет сообщений завершен")
             
             # Пересылаем сообщения в обратном порядке (от старых к новым)
@@ -512,7 +849,7 @@ class MediaForwarder:
             while True:
                 # Получаем пакет сообщений
                 batch = []
-                logger.info(f"Загружаем пакет сообщений с offset_id={offset_id}...")
+                logger.info("Загружаем пакет сообщений с offset_id=%s...", offset_id)
                 messages_iter = self.client.iter_messages(
                     self.source_chat, 
                     limit=batch_size, 
@@ -525,8 +862,12 @@ class MediaForwarder:
                     processed += 1
                     if limit and processed >= limit:
                         break
+                    # Уступаем цикл событий, чтобы не задерживать обработку
+                    # новых сообщений, пока пакет читается из буфера
+                    if processed % 50 == 0:
+                        await asyncio.sleep(0)
                 
-                logger.info(f"Загружено сообщений в пакете: {len(batch)}")
+                logger.info("Загружено сообщений в пакете: %s", len(batch))
                 
                 if not batch:
                     logger.info("Больше сообщений не найдено.")
@@ -551,126 +892,388 @@ class MediaForwarder:
                         # Одиночные сообщения обрабатываем отдельно
                         single_messages.append(message)
                 
-                # Обрабатываем одиночные сообщения
-                for message in single_messages:
-                    should_forward = self.should_forward_message(message)
-                    if should_forward:
-                        try:
-                            await self.client.forward_messages(self.target_chat, message)
-                            count += 1
-                            delay = self.config.data['delay']
-                            logger.info(f"Переслано сообщение #{count}. ID: {message.id}. Дата: {message.date}")
-                            if progress_callback:
-                                await progress_callback(count, total_messages, f"Переслано сообщений: {count}")
-                            await asyncio.sleep(delay)
-                        except FloodWaitError as e:
-                            logger.warning(f"Слишком много запросов, ждем {e.seconds} секунд")
-                            if progress_callback:
-                                await progress_callback(count, total_messages, f"Слишком много запросов, ждем {e.seconds} секунд")
-                            await asyncio.sleep(e.seconds)
-                        except Exception as e:
-                            logger.error(f"Ошибка при пересылке сообщения {message.id}: {e}")
-                            continue
-                
-                # Обрабатываем группы сообщений
+                # Собираем подходящие сообщения пакета в "юниты": одиночные
+                # сообщения и целые альбомы (альбом не должен рваться между запросами)
+                units = [[m] for m in single_messages if self.should_forward_message(m)]
+
                 for grouped_id, messages in messages_by_group.items():
                     # Пропускаем, если группа уже обработана
                     if grouped_id in forwarded_groups:
                         continue
-                    
-                    # Проверяем, есть ли в группе хотя бы одно сообщение, подходящее под критерии
-                    has_matching_media = any(self.should_forward_message(m) for m in messages)
-                    
-                    if has_matching_media:
-                        try:
-                            # Пересылаем всю группу
-                            await self.client.forward_messages(self.target_chat, messages)
-                            count += len(messages)
-                            forwarded_groups.add(grouped_id)  # Помечаем как переслано
-                            delay = self.config.data['delay']
-                            logger.info(f"Переслана группа медиа ({len(messages)} элементов). Всего: {count}")
-                            if progress_callback:
-                                await progress_callback(count, total_messages, f"Переслано сообщений: {count}")
-                            await asyncio.sleep(delay)
-                        except FloodWaitError as e:
-                            logger.warning(f"Слишком много запросов, ждем {e.seconds} секунд")
-                            if progress_callback:
-                                await progress_callback(count, total_messages, f"Слишком много запросов, ждем {e.seconds} секунд")
-                            await asyncio.sleep(e.seconds)
-                        except Exception as e:
-                            logger.error(f"Ошибка при пересылке группы медиа: {e}")
-                            continue
+
+                    # Берем группу целиком, если в ней есть подходящее медиа
+                    if any(self.should_forward_message(m) for m in messages):
+                        units.append(messages)
+                        forwarded_groups.add(grouped_id)  # Помечаем как переслано
+
+                # Упаковываем юниты в под-пакеты и пересылаем их параллельно
+                # под семафором, чтобы держать умеренный темп запросов
+                chunks = []
+                current_chunk = []
+                for unit in units:
+                    if current_chunk and len(current_chunk) + len(unit) > FORWARD_CHUNK_SIZE:
+                        chunks.append(current_chunk)
+                        current_chunk = []
+                    current_chunk.extend(unit)
+                if current_chunk:
+                    chunks.append(current_chunk)
+
+                if chunks:
+                    results = await asyncio.gather(
+                        *[self._forward_chunk(chunk) for chunk in chunks]
+                    )
+                    forwarded = sum(results)
+                    count += forwarded
+                    logger.info("Переслано сообщений в пакете: %s. Всего: %s", forwarded, count)
+                    if progress_callback:
+                        await progress_callback(count, total_messages, f"Переслано сообщений: {count}")
                 
                 if limit and processed >= limit:
-                    logger.info(f"Достигнут лимит сообщений: {limit}")
+                    logger.info("Достигнут лимит сообщений: %s", limit)
                     break
             
             # После пересылки всех сообщений запускаем мониторинг новых
             logger.info("Запускаем мониторинг новых сообщений...")
-            await self.start_forward_monitoring(self.source_chat, self.target_chat, self.media_types)
+            await self.start_forward_monitoring(self.source_chat, self.target_chat, self.media_mask)
             logger.info("Мониторинг новых сообщений запущен.")
                         
         except Exception as e:
-            logger.error(f"Ошибка в процессе пересылки: {e}")
+            logger.error("Ошибка в процессе пересылки: %s", e)
             return False, count
             
         return True, count
     
+    async def _forward_chunk(self, chunk: List[Message]) -> int:
+        """Пересылает под-пакет сообщений под семафором
+
+        Возвращает количество пересланных сообщений (0 при ошибке).
+        """
+        async with self._forward_sem:
+            try:
+                await self.client.forward_messages(self.target_chat, chunk)
+                self._on_forward_success()
+                await asyncio.sleep(self._current_delay)
+                return len(chunk)
+            except FloodWaitError as e:
+                self._on_flood_wait()
+                logger.warning("Слишком много запросов, ждем %s секунд", e.seconds)
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                logger.error("Ошибка при пересылке пакета сообщений: %s", e)
+            return 0
+
     async def get_active_forwards(self):
         """Получение списка активных пересылок"""
         result = []
         for (source_id, target_id), data in self.active_forwards.items():
             if data['is_running']:
                 try:
-                    source = await self.client.get_entity(int(source_id))
-                    
-                    if target_id == "saved_messages" or target_id == SAVED_MESSAGES_KEY:
+                    source = await self.get_entity_cached(source_id)
+
+                    if target_id == "saved_messages":
                         target_name = "Избранное"
                     else:
-                        target = await self.client.get_entity(int(target_id))
-                        target_name = target.title if hasattr(target, 'title') else target.first_name
+                        target = await self.get_entity_cached(target_id)
+                        target_name = self._display_name(target)
                     
                     result.append({
                         'source_id': source_id,
-                        'source_name': source.title if hasattr(source, 'title') else source.first_name,
+                        'source_name': self._display_name(source),
                         'target_id': target_id,
                         'target_name': target_name,
-                        'media_types': list(data['media_types'])
+                        'media_types': media_names_from_mask(data['media_mask'])
                     })
                 except Exception as e:
-                    logger.error(f"Ошибка при получении данных активной пересылки: {e}")
+                    logger.error("Ошибка при получении данных активной пересылки: %s", e)
         
         return result
 
 
+# Варианты задержки для экрана настроек: (подпись, callback_data)
+_DELAY_OPTIONS_ROWS = (
+    (("1 сек", "delay_1"), ("3 сек", "delay_3"), ("5 сек", "delay_5")),
+    (("10 сек", "delay_10"), ("30 сек", "delay_30")),
+)
+
+
+@functools.lru_cache(maxsize=16)
+def _build_delay_kb(current_delay: int) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру настроек задержки
+
+    Вариантов задержки мало, поэтому кэшируем готовую клавиатуру по
+    текущему значению и не пересоздаем кнопки на каждый показ настроек.
+    """
+    rows = [[InlineKeyboardButton(
+        text=f"Текущая задержка: {current_delay} сек",
+        callback_data="settings_info"
+    )]]
+    for option_row in _DELAY_OPTIONS_ROWS:
+        rows.append([
+            InlineKeyboardButton(text=text, callback_data=data)
+            for text, data in option_row
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@functools.lru_cache(maxsize=32)
+def _build_forwards_kb(fingerprint: tuple) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру активных пересылок по их отпечатку
+
+    Отпечаток — кортеж кортежей (source_id, source_name, target_id,
+    target_name, типы медиа) по каждой пересылке: неизменившийся список
+    отдает готовую клавиатуру из кэша без пересборки кнопок и
+    pydantic-валидации.
+    """
+    rows = []
+    for i, (source_id, source_name, target_id, target_name, media_names) in enumerate(fingerprint):
+        media_types_text = ", ".join(
+            label for name, label in _MEDIA_LABELS if name in media_names
+        )
+
+        # Используем сокращенный ключ для Избранного в callback_data
+        target_id_for_callback = SAVED_MESSAGES_KEY if target_id == "saved_messages" else target_id
+
+        rows.append([
+            InlineKeyboardButton(
+                text=f"{i+1}. {source_name} ➡️ {target_name}",
+                callback_data=f"forward_info_{source_id}_{target_id_for_callback}"
+            )
+        ])
+        rows.append([
+            InlineKeyboardButton(
+                text=f"📄 {media_types_text}",
+                callback_data=f"forward_types_{source_id}_{target_id_for_callback}"
+            )
+        ])
+        rows.append([
+            InlineKeyboardButton(
+                text="🛑 Остановить",
+                callback_data=f"forward_stop_{source_id}_{target_id_for_callback}"
+            )
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+# Текст экрана настроек не зависит от выбранной задержки
+_SETTINGS_TEXT = (
+    "⚙️ Настройки пересылки:\n\n"
+    "Задержка между сообщениями влияет на скорость пересылки. "
+    "Слишком маленькая задержка может привести к ограничениям со стороны Telegram."
+)
+
+
+@functools.lru_cache(maxsize=16)
+def _render_settings(delay: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Готовая пара (текст, клавиатура) экрана настроек для значения задержки"""
+    return _SETTINGS_TEXT, _build_delay_kb(delay)
+
+
+@functools.lru_cache(maxsize=8)
+def _build_media_kb(media_mask: MediaTypes) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру выбора типов медиа с отметками выбранного
+
+    Комбинаций маски всего восемь — кэшируем готовые клавиатуры.
+    """
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"📷 Фото {'✅' if media_mask & MediaTypes.PHOTO else ''}",
+                callback_data="media_photo"
+            ),
+            InlineKeyboardButton(
+                text=f"🎥 Видео {'✅' if media_mask & MediaTypes.VIDEO else ''}",
+                callback_data="media_video"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=f"📎 Документы {'✅' if media_mask & MediaTypes.DOCUMENT else ''}",
+                callback_data="media_document"
+            ),
+            InlineKeyboardButton(
+                text="📄 Все типы",
+                callback_data="media_all"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="✅ Продолжить",
+                callback_data="continue_setup"
+            )
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
 # Функция для проверки доступа пользователя
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
-    return user_id == ADMIN_USER_ID
+    return user_id in ADMIN_IDS
+
+
+# Часто используемые тексты ответов: один объект строки на все обращения
+_DENY_TEXT = "⛔ Доступ запрещен. Этот бот доступен только для администратора."
+_BUSY_TEXT = "Бот перегружен. Попробуйте позже."
+_QUEUED_TEXT = "В очереди..."
+_NO_FORWARDS_TEXT = "У вас нет активных пересылок. Нажмите «📱 Создать пересылку» для настройки."
+
+# Кого и когда уже уведомили об отказе: {user_id: момент ответа}.
+# Без этого каждый спам-апдейт превращался бы в исходящий вызов API.
+_DENY_NOTIFIED = OrderedDict()
+_DENY_NOTIFY_TTL = 60  # Не чаще одного отказа пользователю в минуту
+_DENY_NOTIFIED_MAX = 10000  # Ограничение памяти при флуде с многих аккаунтов
+
+# Очередь отложенных отказов: мидлварь только кладет chat_id, а отправкой
+# с фиксированным темпом владеет один воркер — всплеск входящего спама
+# не превращается во всплеск исходящих запросов
+_deny_q: asyncio.Queue = asyncio.Queue(maxsize=DENY_QUEUE_SIZE)
+
+
+class AdminMiddleware(BaseMiddleware):
+    """Отсекает обращения не-администраторов до вызова обработчиков
+
+    Одна централизованная проверка вместо дублирования is_admin в каждом
+    обработчике: не-админ получает отказ, а обработчик (и его FSM-контекст)
+    даже не создается.
+    """
+
+    async def __call__(self, handler, event, data):
+        # Проверка встроена по месту: на самом горячем пути (флуд от
+        # посторонних) не тратимся даже на вызов is_admin
+        user = event.from_user
+        if user is None or user.id not in ADMIN_IDS:
+            if user is None:
+                return None
+            if isinstance(event, CallbackQuery):
+                # cache_time: Telegram кэширует ответ на стороне клиента,
+                # и повторные тапы той же кнопки 5 минут не доходят до бота
+                await event.answer(_DENY_TEXT, cache_time=300)
+            else:
+                # В группах и каналах молчим: отвечать на чужой трафик незачем
+                if event.chat.type != 'private':
+                    return None
+                # Отвечаем каждому пользователю не чаще раза в минуту:
+                # флуд не конвертируется один-в-один в исходящие запросы
+                now = time.monotonic()
+                last = _DENY_NOTIFIED.get(user.id)
+                if last is not None and now - last < _DENY_NOTIFY_TTL:
+                    return None
+                _DENY_NOTIFIED[user.id] = now
+                _DENY_NOTIFIED.move_to_end(user.id)
+                if len(_DENY_NOTIFIED) > _DENY_NOTIFIED_MAX:
+                    _DENY_NOTIFIED.popitem(last=False)
+                try:
+                    _deny_q.put_nowait(event.chat.id)
+                except asyncio.QueueFull:
+                    pass  # Очередь полна — при таком флуде молчим
+            return None
+        return await handler(event, data)
 
 
 async def main():
     """Основная функция запуска бота"""
-    
-    # Инициализация конфигурации
-    config = Configuration()
+
+    # На Python 3.12+ включаем энергичные таски: корутины, которые не
+    # блокируются, выполняются сразу без лишнего круга через планировщик
+    if hasattr(asyncio, 'eager_task_factory'):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+    # Инициализация конфигурации: чтение файла уходит в пул потоков,
+    # чтобы не блокировать цикл событий на дисковом вводе-выводе
+    config = await asyncio.to_thread(Configuration)
     
     # Инициализация форвардера
     forwarder = MediaForwarder(API_ID, API_HASH, SESSION_NAME, config)
     await forwarder.connect()
     
-    # Настройка бота для aiogram 3.x
-    bot = Bot(token=BOT_TOKEN)
+    # Настройка бота для aiogram 3.x. Коннектор aiohttp настраиваем на
+    # долгоживущие HTTPS-соединения к api.telegram.org: keepalive дольше
+    # пауз между запросами экономит TLS-рукопожатие на каждый вызов
+    if LOCAL_API_URL:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(LOCAL_API_URL),
+            json_loads=_json_loads,
+            json_dumps=_json_dumps,
+        )
+    else:
+        session = AiohttpSession(json_loads=_json_loads, json_dumps=_json_dumps)
+    session._connector_init.update(
+        limit=64,
+        limit_per_host=32,
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+    )
+    bot = Bot(token=BOT_TOKEN, session=session)
     dp = Dispatcher(storage=MemoryStorage())
-    
+
+    # Проверка прав выполняется один раз на уровне диспетчера
+    dp.message.middleware(AdminMiddleware())
+    dp.callback_query.middleware(AdminMiddleware())
+
+    # Очередь тяжелых задач: при шквале нажатий ограниченный буфер дает
+    # обратное давление вместо создания задачи на каждое нажатие, а пул
+    # воркеров с паузами укладывает работу в лимиты Telegram
+    _work_q = asyncio.Queue(maxsize=WORK_QUEUE_SIZE)
+
+    async def _worker():
+        while True:
+            job = await _work_q.get()
+            try:
+                await job()
+            except Exception as e:
+                logger.error("Ошибка при выполнении задачи из очереди: %s", e)
+            finally:
+                _work_q.task_done()
+                # WORK_WORKERS воркеров с такой паузой суммарно не
+                # превышают бот-лимит исходящих запросов
+                await asyncio.sleep(WORK_PACING_DELAY)
+
+    worker_tasks = [asyncio.create_task(_worker()) for _ in range(WORK_WORKERS)]
+
+    async def _deny_worker():
+        """Разбирает очередь отказов с фиксированным темпом отправки"""
+        while True:
+            chat_id = await _deny_q.get()
+            try:
+                await bot.send_message(chat_id, _DENY_TEXT)
+            except Exception as e:
+                logger.error("Ошибка при отправке отказа: %s", e)
+            finally:
+                _deny_q.task_done()
+                await asyncio.sleep(DENY_PACING_DELAY)
+
+    worker_tasks.append(asyncio.create_task(_deny_worker()))
+
+    # Короткий кэш списка активных пересылок с защитой от "давки":
+    # одновременные нажатия в двухсекундном окне делят один запрос к Telegram
+    _af_cache = {'at': 0.0, 'value': None, 'version': -1}
+    _af_lock = asyncio.Lock()
+
+    def _af_cache_fresh():
+        # Кэш устаревает либо по TTL, либо сразу при изменении списка
+        # пересылок (версия форвардера растет при каждой мутации)
+        return (_af_cache['value'] is not None
+                and _af_cache['version'] == forwarder._version
+                and time.monotonic() - _af_cache['at'] < ACTIVE_FORWARDS_CACHE_TTL)
+
+    async def cached_active_forwards():
+        """Возвращает список активных пересылок, объединяя параллельные запросы"""
+        if _af_cache_fresh():
+            return _af_cache['value']
+        async with _af_lock:
+            # Пока ждали замок, кэш мог обновить другой запрос
+            if _af_cache_fresh():
+                return _af_cache['value']
+            version = forwarder._version
+            value = await forwarder.get_active_forwards()
+            _af_cache['value'] = value
+            _af_cache['at'] = time.monotonic()
+            _af_cache['version'] = version
+            return value
+
     # Обработчики сообщений и callback-запросов
     @dp.message(Command("start"))
     async def cmd_start(message: AiogramMessage):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         keyboard = ReplyKeyboardMarkup(
             keyboard=[
                 [KeyboardButton(text="📱 Создать пересылку")],
@@ -690,149 +1293,96 @@ async def main():
         )
     
     @dp.message(F.text == "📱 Создать пересылку")
-    async def create_forwarding(message: AiogramMessage, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
+    async def create_forwarding(message: AiogramMessage):
         # Получаем список диалогов
-        await show_dialog_list(message, state, is_source=True)
+        await show_dialog_list(message, is_source=True)
     
     @dp.message(F.text == "⚙️ Настройки")
     async def show_settings(message: AiogramMessage):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
-        current_delay = config.data['delay']
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"Текущая задержка: {current_delay} сек", callback_data="settings_info")],
-            [
-                InlineKeyboardButton(text="1 сек", callback_data="delay_1"),
-                InlineKeyboardButton(text="3 сек", callback_data="delay_3"),
-                InlineKeyboardButton(text="5 сек", callback_data="delay_5")
-            ],
-            [
-                InlineKeyboardButton(text="10 сек", callback_data="delay_10"),
-                InlineKeyboardButton(text="30 сек", callback_data="delay_30")
-            ]
-        ])
-        
-        await message.answer(
-            "⚙️ Настройки пересылки:\n\n"
-            "Задержка между сообщениями влияет на скорость пересылки. "
-            "Слишком маленькая задержка может привести к ограничениям со стороны Telegram.",
-            reply_markup=keyboard
-        )
+        text, keyboard = _render_settings(config.data['delay'])
+        await message.answer(text, reply_markup=keyboard)
     
     @dp.message(F.text == "📋 Активные пересылки")
     async def show_active_forwards(message: AiogramMessage):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
-        active_forwards = await forwarder.get_active_forwards()
-        
-        if not active_forwards:
-            await message.answer("У вас нет активных пересылок. Нажмите «📱 Создать пересылку» для настройки.")
-            return
-            
+        active_forwards = await cached_active_forwards()
         await create_forwarding_keyboard(message.chat.id, active_forwards)
     
-    @dp.callback_query(lambda c: c.data.startswith('delay_'))
-    async def process_delay_setting(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
+    # Хэш последнего отрендеренного содержимого по сообщению: повторный
+    # edit_text с тем же текстом и клавиатурой дает от Telegram ошибку
+    # "message is not modified" — лишний сетевой вызов и шум в логе
+    _last_render = OrderedDict()
+
+    async def _edit_if_changed(message, text, keyboard):
+        """Редактирует сообщение, только если содержимое изменилось"""
+        key = (message.chat.id, message.message_id)
+        digest = hash((text, keyboard.model_dump_json() if keyboard else None))
+        if _last_render.get(key) == digest:
             return
-        
+        _last_render[key] = digest
+        _last_render.move_to_end(key)
+        if len(_last_render) > 1024:
+            _last_render.popitem(last=False)
+        await message.edit_text(text, reply_markup=keyboard)
+
+    @dp.callback_query(F.data.startswith('delay_'))
+    async def process_delay_setting(callback_query: CallbackQuery):
         delay = int(callback_query.data.split('_')[1])
+
+        # Повторный тап по текущему значению: экран не изменится,
+        # достаточно закрыть "часики" без перерисовки
+        if delay == config.data['delay']:
+            await callback_query.answer(f"Задержка уже установлена на {delay} секунд")
+            return
+
         config.set_delay(delay)
+        # Новая настройка становится отправной точкой адаптивной задержки
+        forwarder._current_delay = float(delay)
         await callback_query.answer(f"Задержка установлена на {delay} секунд")
-        
+
         # Обновляем сообщение с настройками
-        current_delay = config.data['delay']
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"Текущая задержка: {current_delay} сек", callback_data="settings_info")],
-            [
-                InlineKeyboardButton(text="1 сек", callback_data="delay_1"),
-                InlineKeyboardButton(text="3 сек", callback_data="delay_3"),
-                InlineKeyboardButton(text="5 сек", callback_data="delay_5")
-            ],
-            [
-                InlineKeyboardButton(text="10 сек", callback_data="delay_10"),
-                InlineKeyboardButton(text="30 сек", callback_data="delay_30")
-            ]
-        ])
-        
-        await callback_query.message.edit_text(
-            "⚙️ Настройки пересылки:\n\n"
-            "Задержка между сообщениями влияет на скорость пересылки. "
-            "Слишком маленькая задержка может привести к ограничениям со стороны Telegram.",
-            reply_markup=keyboard
-        )
+        text, keyboard = _render_settings(delay)
+        await _edit_if_changed(callback_query.message, text, keyboard)
     
-    @dp.callback_query(lambda c: c.data.startswith('forward_stop_'))
+    @dp.callback_query(F.data.startswith('forward_stop_'))
     async def stop_forward(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
+        # Идентификаторы — два последних сегмента; rsplit не ломается,
+        # если префикс когда-нибудь сам будет содержать подчеркивания
+        _, source_id, target_id = callback_query.data.rsplit('_', 2)
+
+        logger.info("Получена команда остановки пересылки: %s -> %s", source_id, target_id)
+
+        # Обработчик только ставит задачу в очередь: тяжелая работа
+        # выполняется воркером, а пользователь сразу получает ответ
+        try:
+            _work_q.put_nowait(functools.partial(_do_stop_forward, callback_query, source_id, target_id))
+        except asyncio.QueueFull:
+            await callback_query.answer(_BUSY_TEXT)
             return
-        
-        parts = callback_query.data.split('_')
-        source_id = parts[2]
-        target_id = parts[3]
-        
-        logger.info(f"Получена команда остановки пересылки: {source_id} -> {target_id}")
-        
+        await callback_query.answer(_QUEUED_TEXT)
+
+    async def _do_stop_forward(callback_query, source_id, target_id):
+        """Фактическая остановка пересылки; выполняется воркером очереди"""
         try:
-            # Показываем промежуточное сообщение
-            await callback_query.answer("Останавливаю пересылку...")
             status_message = await callback_query.message.edit_text(
                 "⏳ Останавливаю пересылку...",
                 reply_markup=None
             )
             
-            # Запускаем остановку в отдельной задаче
-            stop_task = asyncio.create_task(forwarder.stop_forward_monitoring(source_id, target_id))
-            success = await stop_task
+            success = await forwarder.stop_forward_monitoring(source_id, target_id)
             
             if success:
-                await status_message.edit_text("✅ Пересылка успешно остановлена!")
-                # Обновляем список активных пересылок после небольшой задержки
-                await asyncio.sleep(1)
-                
-                # Проверяем, есть ли активные пересылки
-                active_forwards = await forwarder.get_active_forwards()
-                if active_forwards:
-                    # Отправляем новое сообщение вместо обновления старого
-                    try:
-                        # Используем метод отправки сообщения в чат
-                        await bot.send_message(
-                            chat_id=callback_query.message.chat.id,
-                            text="Ваши активные пересылки:"
-                        )
-                        # После этого обновляем список активных пересылок
-                        await create_forwarding_keyboard(callback_query.message.chat.id, active_forwards)
-                    except Exception as e:
-                        logger.error(f"Ошибка при обновлении списка активных пересылок: {e}")
-                else:
-                    # Если нет активных пересылок, сообщаем об этом
-                    try:
-                        await bot.send_message(
-                            chat_id=callback_query.message.chat.id,
-                            text="У вас нет активных пересылок. Нажмите «📱 Создать пересылку» для настройки."
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке сообщения об отсутствии активных пересылок: {e}")
+                # Редактирование статуса и запрос актуального списка
+                # не зависят друг от друга — выполняем их параллельно
+                _, active_forwards = await asyncio.gather(
+                    status_message.edit_text("✅ Пересылка успешно остановлена!"),
+                    cached_active_forwards()
+                )
+                # Одно сообщение со списком (или с подсказкой, если список пуст)
+                await create_forwarding_keyboard(callback_query.message.chat.id, active_forwards)
             else:
                 await status_message.edit_text("❌ Не удалось остановить пересылку. Попробуйте еще раз.")
         except Exception as e:
-            logger.error(f"Ошибка при остановке пересылки: {e}")
+            logger.error("Ошибка при остановке пересылки: %s", e)
             try:
                 # Используем метод edit_message_text вместо answer
                 await bot.edit_message_text(
@@ -841,41 +1391,29 @@ async def main():
                     text=f"❌ Произошла ошибка при остановке пересылки"
                 )
             except Exception as e2:
-                logger.error(f"Не удалось отправить сообщение об ошибке: {e2}")
+                logger.error("Не удалось отправить сообщение об ошибке: %s", e2)
     
     async def create_forwarding_keyboard(chat_id, active_forwards):
-        """Создаёт и отправляет клавиатуру с активными пересылками"""
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        
-        for i, forward in enumerate(active_forwards):
-            media_types_text = ", ".join([
-                "Фото" if "photo" in forward['media_types'] else "",
-                "Видео" if "video" in forward['media_types'] else "",
-                "Документы" if "document" in forward['media_types'] else ""
-            ]).replace(", ,", ",").strip(", ")
-            
-            # Используем сокращенный ключ для Избранного в callback_data
-            target_id_for_callback = SAVED_MESSAGES_KEY if forward['target_id'] == "saved_messages" else forward['target_id']
-            
-            keyboard.inline_keyboard.append([
-                InlineKeyboardButton(
-                    text=f"{i+1}. {forward['source_name']} ➡️ {forward['target_name']}",
-                    callback_data=f"forward_info_{forward['source_id']}_{target_id_for_callback}"
-                )
-            ])
-            keyboard.inline_keyboard.append([
-                InlineKeyboardButton(
-                    text=f"📄 {media_types_text}",
-                    callback_data=f"forward_types_{forward['source_id']}_{target_id_for_callback}"
-                )
-            ])
-            keyboard.inline_keyboard.append([
-                InlineKeyboardButton(
-                    text="🛑 Остановить",
-                    callback_data=f"forward_stop_{forward['source_id']}_{target_id_for_callback}"
-                )
-            ])
-        
+        """Создаёт и отправляет клавиатуру с активными пересылками
+
+        Пустой список тоже обрабатывается здесь — вызывающим не нужно
+        отправлять отдельное сообщение-подсказку.
+        """
+        if not active_forwards:
+            try:
+                await bot.send_message(chat_id=chat_id, text=_NO_FORWARDS_TEXT)
+            except Exception as e:
+                logger.error("Ошибка при отправке сообщения об отсутствии активных пересылок: %s", e)
+            return
+
+        # Хэшируемый отпечаток списка — ключ кэша готовых клавиатур
+        fingerprint = tuple(
+            (f['source_id'], f['source_name'], f['target_id'], f['target_name'],
+             tuple(f['media_types']))
+            for f in active_forwards
+        )
+        keyboard = _build_forwards_kb(fingerprint)
+
         try:
             await bot.send_message(
                 chat_id=chat_id,
@@ -883,15 +1421,10 @@ async def main():
                 reply_markup=keyboard
             )
         except Exception as e:
-            logger.error(f"Ошибка при отправке клавиатуры с активными пересылками: {e}")
+            logger.error("Ошибка при отправке клавиатуры с активными пересылками: %s", e)
     
-    @dp.callback_query(lambda c: c.data.startswith('dialog_source_'))
-    async def process_source_selection(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
+    @dp.callback_query(F.data.startswith('dialog_source_'))
+    async def process_source_selection(callback_query: CallbackQuery):
         chat_id = int(callback_query.data.split('_')[2])
         success, name = await forwarder.set_source(chat_id)
         
@@ -923,23 +1456,13 @@ async def main():
         
         await message.answer("Выберите, куда пересылать контент:", reply_markup=keyboard)
     
-    @dp.callback_query(lambda c: c.data == "target_select_chat")
-    async def show_target_chat_selection(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
+    @dp.callback_query(F.data == 'target_select_chat')
+    async def show_target_chat_selection(callback_query: CallbackQuery):
         await callback_query.answer()
-        await show_dialog_list(callback_query.message, state, is_source=False)
+        await show_dialog_list(callback_query.message, is_source=False)
     
-    @dp.callback_query(lambda c: c.data == "target_saved_messages")
+    @dp.callback_query(F.data == 'target_saved_messages')
     async def select_saved_messages(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         success, name = await forwarder.set_target(SAVED_MESSAGES_KEY)
         
         if not success:
@@ -951,13 +1474,8 @@ async def main():
         # Переходим к выбору типов медиа
         await show_media_selection(callback_query.message)
     
-    @dp.callback_query(lambda c: c.data.startswith('dialog_target_'))
+    @dp.callback_query(F.data.startswith('dialog_target_'))
     async def process_target_selection(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         chat_id = int(callback_query.data.split('_')[2])
         success, name = await forwarder.set_target(chat_id)
         
@@ -970,13 +1488,27 @@ async def main():
         # Переходим к выбору типов медиа
         await show_media_selection(callback_query.message)
     
-    async def show_dialog_list(message, state, is_source=True, offset=0, query=None):
-        """Показывает список диалогов с пагинацией и поиском"""
+    # Поисковые запросы хранятся на стороне бота: в callback_data уходит
+    # только короткий токен, поэтому длина запроса и спецсимволы в нем
+    # не упираются в 64-байтовый лимит callback_data
+    _search_queries = OrderedDict()
+
+    def _remember_query(query):
+        """Сохраняет запрос и возвращает его короткий токен (8 hex-символов)"""
+        token = format(zlib.crc32(query.encode('utf-8')), '08x')
+        _search_queries[token] = query
+        _search_queries.move_to_end(token)
+        if len(_search_queries) > 64:
+            _search_queries.popitem(last=False)
+        return token
+
+    async def build_dialog_list(is_source=True, offset=0, query=None):
+        """Собирает текст и клавиатуру списка диалогов с пагинацией и поиском"""
         # Получаем диалоги с учетом пагинации и поиска
         dialogs, total = await forwarder.get_dialogs(offset=offset, limit=5, query=query)
         
-        # Создаем клавиатуру
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+        # Собираем строки клавиатуры в обычном списке, разметку создаем один раз
+        rows = []
         
         # Добавляем кнопки для диалогов
         for dialog in dialogs:
@@ -984,68 +1516,71 @@ async def main():
             btn_text = f"{type_icon} {dialog['name']}"
             
             callback_data = f"dialog_source_{dialog['id']}" if is_source else f"dialog_target_{dialog['id']}"
-            keyboard.inline_keyboard.append([
+            rows.append([
                 InlineKeyboardButton(text=btn_text, callback_data=callback_data)
             ])
         
         # Добавляем кнопки навигации
         nav_buttons = []
-        
+        role = 'source' if is_source else 'target'
+        query_token = _remember_query(query) if query else ''
+
         if offset > 0:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="◀️ Назад",
-                    callback_data=f"nav_{'source' if is_source else 'target'}_{offset-5}_{query or ''}"
+                    callback_data=f"nav_{role}_{offset-5}_{query_token}"
                 )
             )
-            
+
         if offset + 5 < total:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="▶️ Далее",
-                    callback_data=f"nav_{'source' if is_source else 'target'}_{offset+5}_{query or ''}"
+                    callback_data=f"nav_{role}_{offset+5}_{query_token}"
                 )
             )
             
         if nav_buttons:
-            keyboard.inline_keyboard.append(nav_buttons)
+            rows.append(nav_buttons)
         
         # Добавляем кнопку поиска
-        keyboard.inline_keyboard.append([
+        rows.append([
             InlineKeyboardButton(
                 text="🔍 Поиск",
                 callback_data=f"search_{'source' if is_source else 'target'}"
             )
         ])
         
+        keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
+        
         text = "Выберите источник для пересылки:" if is_source else "Выберите чат для пересылки:"
         if query:
             text = f"Результаты поиска «{query}»:\n\n{text}"
-            
+
+        return text, keyboard
+
+    async def show_dialog_list(message, is_source=True, offset=0, query=None):
+        """Показывает список диалогов новым сообщением"""
+        text, keyboard = await build_dialog_list(is_source, offset, query)
         await message.answer(text, reply_markup=keyboard)
-    
-    @dp.callback_query(lambda c: c.data.startswith('nav_'))
-    async def process_navigation(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
+
+    @dp.callback_query(F.data.startswith('nav_'))
+    async def process_navigation(callback_query: CallbackQuery):
         parts = callback_query.data.split('_')
         is_source = parts[1] == 'source'
         offset = int(parts[2])
-        query = parts[3] if len(parts) > 3 and parts[3] else None
-        
-        await callback_query.message.delete()
-        await show_dialog_list(callback_query.message, state, is_source, offset, query)
+        # Токен разворачиваем в сохраненный запрос; после перезапуска бота
+        # токен неизвестен — показываем нефильтрованный список
+        query = _search_queries.get(parts[3]) if len(parts) > 3 and parts[3] else None
+
+        # Редактируем сообщение на месте: один запрос вместо удаления
+        # и отправки нового, и список не прыгает по чату
+        text, keyboard = await build_dialog_list(is_source, offset, query)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
     
-    @dp.callback_query(lambda c: c.data.startswith('search_'))
+    @dp.callback_query(F.data.startswith('search_'))
     async def process_search_request(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         is_source = callback_query.data.split('_')[1] == 'source'
         
         # Сохраняем информацию о том, для чего выполняется поиск
@@ -1058,11 +1593,6 @@ async def main():
     
     @dp.message(ForwardingStates.waiting_for_search)
     async def process_search_query(message: AiogramMessage, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         # Получаем данные из состояния
         data = await state.get_data()
         is_source = data.get('search_for', True)
@@ -1071,43 +1601,15 @@ async def main():
         await state.clear()
         
         # Показываем результаты поиска
-        await show_dialog_list(message, state, is_source, offset=0, query=message.text)
+        await show_dialog_list(message, is_source, offset=0, query=message.text)
     
     async def show_media_selection(message):
         """Показывает экран выбора типов медиаконтента"""
-        # Создаем клавиатуру для выбора типов медиа
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="📷 Фото",
-                    callback_data="media_photo"
-                ),
-                InlineKeyboardButton(
-                    text="🎥 Видео",
-                    callback_data="media_video"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="📎 Документы",
-                    callback_data="media_document"
-                ),
-                InlineKeyboardButton(
-                    text="📄 Все типы",
-                    callback_data="media_all"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="✅ Продолжить",
-                    callback_data="continue_setup"
-                )
-            ]
-        ])
-        
-        source_name = forwarder.source_chat.title if hasattr(forwarder.source_chat, 'title') else forwarder.source_chat.first_name
-        target_name = "Избранное" if forwarder.target_chat.id == forwarder.saved_messages.id else \
-                      forwarder.target_chat.title if hasattr(forwarder.target_chat, 'title') else forwarder.target_chat.first_name
+        # Клавиатура выбора типов медиа (кэшируется по текущей маске)
+        keyboard = _build_media_kb(forwarder.media_mask)
+
+        source_name = forwarder.source_name
+        target_name = forwarder.target_name
         
         await message.answer(
             f"Настройка пересылки:\n\n"
@@ -1117,77 +1619,38 @@ async def main():
             reply_markup=keyboard
         )
     
-    @dp.callback_query(lambda c: c.data.startswith('media_'))
+    @dp.callback_query(F.data.startswith('media_'))
     async def process_media_selection(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         media_type = callback_query.data.split('_')[1]
         
         if media_type == 'all':
-            forwarder.media_types = {'photo', 'video', 'document'}
+            forwarder.media_mask = MediaTypes.ALL
             await callback_query.answer("Выбраны все типы медиа")
         else:
-            if media_type in forwarder.media_types:
-                forwarder.media_types.remove(media_type)
-                status = "удален из списка"
-            else:
-                forwarder.media_types.add(media_type)
-                status = "добавлен в список"
-                
+            # Переключаем соответствующий бит маски
+            type_bit = MEDIA_TYPE_BITS[media_type]
+            forwarder.media_mask ^= type_bit
+            status = "добавлен в список" if forwarder.media_mask & type_bit else "удален из списка"
+
             await callback_query.answer(f"{media_type.capitalize()} {status}")
         
         # Обновляем клавиатуру, чтобы показать выбранные типы
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text=f"📷 Фото {'✅' if 'photo' in forwarder.media_types else ''}",
-                    callback_data="media_photo"
-                ),
-                InlineKeyboardButton(
-                    text=f"🎥 Видео {'✅' if 'video' in forwarder.media_types else ''}",
-                    callback_data="media_video"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text=f"📎 Документы {'✅' if 'document' in forwarder.media_types else ''}",
-                    callback_data="media_document"
-                ),
-                InlineKeyboardButton(
-                    text="📄 Все типы",
-                    callback_data="media_all"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="✅ Продолжить",
-                    callback_data="continue_setup"
-                )
-            ]
-        ])
-        
-        source_name = forwarder.source_chat.title if hasattr(forwarder.source_chat, 'title') else forwarder.source_chat.first_name
-        target_name = "Избранное" if forwarder.target_chat.id == forwarder.saved_messages.id else \
-                      forwarder.target_chat.title if hasattr(forwarder.target_chat, 'title') else forwarder.target_chat.first_name
-        
-        await callback_query.message.edit_text(
+        keyboard = _build_media_kb(forwarder.media_mask)
+
+        source_name = forwarder.source_name
+        target_name = forwarder.target_name
+
+        await _edit_if_changed(
+            callback_query.message,
             f"Настройка пересылки:\n\n"
             f"📤 Источник: {source_name}\n"
             f"📥 Цель: {target_name}\n\n"
             f"Выберите типы медиаконтента для пересылки:",
-            reply_markup=keyboard
+            keyboard
         )
     
-    @dp.callback_query(lambda c: c.data == 'continue_setup')
-    async def show_limit_options(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
+    @dp.callback_query(F.data == 'continue_setup')
+    async def show_limit_options(callback_query: CallbackQuery):
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(
@@ -1224,13 +1687,8 @@ async def main():
             reply_markup=keyboard
         )
     
-    @dp.callback_query(lambda c: c.data.startswith('limit_'))
+    @dp.callback_query(F.data.startswith('limit_'))
     async def process_limit_selection(callback_query: CallbackQuery, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         limit_option = callback_query.data.split('_')[1]
         
         if limit_option == 'custom':
@@ -1242,17 +1700,17 @@ async def main():
         
         # Определяем лимит
         limit = None if limit_option == 'all' else int(limit_option)
-        
-        # Запускаем процесс пересылки
-        await start_forwarding_process(callback_query.message, limit)
+
+        # Пересылка уходит в очередь тяжелых задач
+        try:
+            _work_q.put_nowait(functools.partial(start_forwarding_process, callback_query.message, limit))
+        except asyncio.QueueFull:
+            await callback_query.answer(_BUSY_TEXT)
+            return
+        await callback_query.answer(_QUEUED_TEXT)
     
     @dp.message(ForwardingStates.waiting_for_limit)
     async def process_custom_limit(message: AiogramMessage, state: FSMContext):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
         try:
             limit = int(message.text.strip())
             if limit <= 0:
@@ -1260,25 +1718,49 @@ async def main():
                 return
                 
             await state.clear()
-            await start_forwarding_process(message, limit)
+            # Пересылка уходит в очередь тяжелых задач
+            try:
+                _work_q.put_nowait(functools.partial(start_forwarding_process, message, limit))
+            except asyncio.QueueFull:
+                await message.answer(_BUSY_TEXT)
         except ValueError:
             await message.answer("Пожалуйста, введите корректное число.")
     
+    # Состояние троттлинга прогресса: время последнего редактирования и
+    # последний отправленный текст по каждому сообщению
+    _progress_state = {}
+
     async def update_progress_message(message_id, chat_id, count, total, status_text):
-        """Обновляет сообщение о прогрессе пересылки"""
+        """Обновляет сообщение о прогрессе пересылки
+
+        Редактирования дороже вычислений: Telegram ограничивает частоту
+        edit_message_text, поэтому промежуточные обновления отправляются не
+        чаще раза в секунду, а повторный текст не отправляется вовсе.
+        Финальное обновление (count >= total) отправляется всегда.
+        """
         try:
             percentage = min(100, int(count / total * 100)) if total > 0 else 0
-            progress_bar = "".join(["█" if i <= percentage // 5 else "░" for i in range(20)])
-            
+            progress_bar = _BARS[percentage // 5]
+
+            text = (f"⏳ Прогресс пересылки: {percentage}% [{count}/{total if total else '?'}]\n"
+                    f"[{progress_bar}]\n\n"
+                    f"{status_text}")
+
+            key = (chat_id, message_id)
+            last_time, last_text = _progress_state.get(key, (0.0, None))
+            now = time.monotonic()
+            is_final = total > 0 and count >= total
+            if not is_final and (now - last_time < 1.0 or text == last_text):
+                return
+            _progress_state[key] = (now, text)
+
             await bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=message_id,
-                text=f"⏳ Прогресс пересылки: {percentage}% [{count}/{total if total else '?'}]\n"
-                     f"[{progress_bar}]\n\n"
-                     f"{status_text}"
+                text=text
             )
         except Exception as e:
-            logger.error(f"Ошибка при обновлении прогресса: {e}")
+            logger.error("Ошибка при обновлении прогресса: %s", e)
     
     async def start_forwarding_process(message, limit=None):
         """Запускает процесс пересылки сообщений"""
@@ -1295,21 +1777,14 @@ async def main():
                 status_text
             )
         
-        # Запускаем пересылку в отдельной задаче
-        task = asyncio.create_task(
-            forwarder.forward_all_media(
+        try:
+            success, count = await forwarder.forward_all_media(
                 progress_callback=progress_callback,
                 limit=limit
             )
-        )
-        
-        # Ожидаем завершения задачи
-        try:
-            success, count = await task
             
-            source_name = forwarder.source_chat.title if hasattr(forwarder.source_chat, 'title') else forwarder.source_chat.first_name
-            target_name = "Избранное" if forwarder.target_chat.id == forwarder.saved_messages.id else \
-                          forwarder.target_chat.title if hasattr(forwarder.target_chat, 'title') else forwarder.target_chat.first_name
+            source_name = forwarder.source_name
+            target_name = forwarder.target_name
             
             source_id = forwarder.source_chat.id
             # Используем сокращенный ключ для Избранного в callback_data
@@ -1347,48 +1822,91 @@ async def main():
                     f"Попробуйте еще раз или проверьте права доступа."
                 )
         except Exception as e:
-            logger.error(f"Ошибка при пересылке: {e}")
+            logger.error("Ошибка при пересылке: %s", e)
             await progress_message.edit_text(
                 f"❌ Произошла ошибка: {str(e)}\n"
                 f"Попробуйте еще раз или выберите другие параметры."
             )
     
-    @dp.callback_query(lambda c: c.data == 'show_active_forwards')
+    @dp.callback_query(F.data == 'show_active_forwards')
     async def callback_show_active_forwards(callback_query: CallbackQuery):
-        # Проверяем, является ли пользователь администратором
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-            return
-        
-        await callback_query.answer()
-        active_forwards = await forwarder.get_active_forwards()
-        if not active_forwards:
-            await callback_query.message.answer("У вас нет активных пересылок. Нажмите «📱 Создать пересылку» для настройки.")
-        else:
-            await create_forwarding_keyboard(callback_query.message.chat.id, active_forwards)
+        # Ответ на callback и получение списка не зависят друг от друга:
+        # запускаем параллельно, "часики" гаснут, пока идет запрос
+        _, active_forwards = await asyncio.gather(
+            callback_query.answer(),
+            cached_active_forwards()
+        )
+        await create_forwarding_keyboard(callback_query.message.chat.id, active_forwards)
     
-    # Обработчик для всех остальных сообщений от неадминистраторов
-    @dp.message()
+    # Обработчики-заглушки для обновлений, не подошедших ни одному фильтру.
+    # Не-администраторы сюда не доходят — их отсекает AdminMiddleware,
+    # поэтому проверка прав внутри не нужна.
+    # Фильтр по типу чата отрабатывает до вызова обработчика:
+    # групповой и канальный трафик не доходит даже до заглушки
+    @dp.message(F.chat.type == "private")
     async def handle_all_messages(message: AiogramMessage):
-        if not is_admin(message.from_user.id):
-            await message.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
-    
-    # Обработчик для всех остальных callback-запросов от неадминистраторов
+        pass
+
     @dp.callback_query()
     async def handle_all_callbacks(callback_query: CallbackQuery):
-        if not is_admin(callback_query.from_user.id):
-            await callback_query.answer("⛔ Доступ запрещен. Этот бот доступен только для администратора.")
+        # Закрываем "часики" на кнопке без обработчика
+        await callback_query.answer()
     
     # Запуск бота для aiogram 3.x
     try:
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            # Режим вебхука: Telegram доставляет обновления сам, обработка
+            # начинается сразу, без ожидания следующего круга getUpdates
+            from aiohttp import web
+            from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+            await bot.set_webhook(WEBHOOK_URL, allowed_updates=["message", "callback_query"])
+            app = web.Application()
+            SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
+            setup_application(app, dp, bot=bot)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            # Сервер работает в фоне — держим main до остановки процесса
+            await asyncio.Event().wait()
+        else:
+            # handle_as_tasks: обработчики не сериализуют пачку getUpdates,
+            # медленный хендлер перекрывается сетевым ожиданием следующего опроса.
+            # allowed_updates: Telegram фильтрует обновления на своей стороне —
+            # членства в чатах, опросы и прочее не приходят и не парсятся
+            await dp.start_polling(
+                bot,
+                handle_as_tasks=True,
+                polling_timeout=30,
+                allowed_updates=["message", "callback_query"]
+            )
     finally:
-        await bot.session.close()
+        for task in worker_tasks:
+            task.cancel()
+        # Сбрасываем отложенные изменения конфигурации перед выходом
+        config.save_now()
+        # Закрытие сессии ограничено по времени: зависшие TCP-соединения
+        # не должны мешать перезапуску процесса супервизором
+        try:
+            await asyncio.wait_for(bot.session.close(), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning("Закрытие сессии бота не уложилось в таймаут")
 
 if __name__ == '__main__':
+    # uvloop (libuv) заметно ускоряет сокеты и планировщик asyncio;
+    # зависимость опциональная — без нее работает стандартный цикл
+    try:
+        import uvloop
+        _loop_factory = uvloop.new_event_loop
+    except ImportError:
+        _loop_factory = None
+
     try:
-        asyncio.run(main())
+        # asyncio.Runner подставляет фабрику цикла без глобального
+        # побочного эффекта uvloop.install() на политику event loop
+        with asyncio.Runner(loop_factory=_loop_factory) as runner:
+            runner.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен вручную")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
+        logger.error("Критическая ошибка: %s", e)